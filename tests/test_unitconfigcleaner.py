@@ -0,0 +1,69 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+import unitconfigcleaner as ucc
+
+
+def build(data, decision_spec=None, duplicate_decision="keep"):
+    """
+    Run build_output on raw CSV bytes and return the cleaned CSV as text.
+    """
+    _, output = ucc.build_output("t.csv", ucc.file_digest(data), data, decision_spec, duplicate_decision)
+    return output.decode("utf-8")
+
+
+def test_numeric_looking_cells_keep_their_text():
+    data = b"Tower,Unit,Zip,Rate,Flag,Big\nA,00123,02134,1.50,true,99999999999999999999\nA,007,1e3, 5 ,x,\nA,7,,,,\n"
+    assert build(data) == (
+        "Tower,Unit,Zip,Rate,Flag,Big\n"
+        "A,A - 00123,02134,1.50,true,99999999999999999999\n"
+        "A,A - 007,1e3, 5 ,x,\n"
+        "A,A - 7,,,,\n"
+    )
+
+
+def test_units_differing_only_in_leading_zeros_are_not_duplicates():
+    data = b"Tower,Unit\nA,007\nA,7\n"
+    assert build(data, duplicate_decision="retain_one") == "Tower,Unit\nA,A - 007\nA,A - 7\n"
+
+
+def test_trailing_empty_headers():
+    data = b"Tower,Unit,,\nA,1,,\nB,2,,\n"
+    assert build(data) == "Tower,Unit,Unnamed: 2,Unnamed: 3\nA,A - 1,,\nB,B - 2,,\n"
+
+
+def test_duplicate_headers():
+    data = b"Unit,Unit,Tower\n1,2,A\n1,3,A\n"
+    assert build(data) == "Unit,Unit.1,Tower\nA - 1,2,A\nA - 1,3,A\n"
+
+
+def test_unicode_whitespace_is_not_a_special_character():
+    units = ucc.strip_column(pd.Series(["a\xa0b", "x　y", "v\x0bx", "1/2", "N/A"]))
+    assert ucc.find_special_chars(units).tolist() == [False, False, False, True, False]
+
+
+def test_reupload_with_same_name_and_size_uses_new_content(monkeypatch):
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.testing.v1 import AppTest
+
+    downloads = []
+    load_and_get_id = MemoryMediaFileStorage.load_and_get_id
+
+    def capture(self, path_or_data, *args, **kwargs):
+        downloads.append(path_or_data)
+        return load_and_get_id(self, path_or_data, *args, **kwargs)
+
+    monkeypatch.setattr(MemoryMediaFileStorage, "load_and_get_id", capture)
+
+    at = AppTest.from_file(ucc.__file__, default_timeout=30).run()
+    at.file_uploader[0].set_value(("u.csv", b"Tower,Unit\nA,1/2\nA,3\nA,4\n", "text/csv")).run()
+    at.file_uploader[0].set_value(("u.csv", b"Tower,Unit\nA,9\nA,ab\nA,7#\n", "text/csv")).run()
+    assert at.dataframe[0].value["Unit"].tolist() == ["7#"]
+
+    at.radio[0].set_value("Delete These Rows").run()
+    at.button[0].click().run()
+    assert downloads[-1] == b"Tower,Unit\nA,A - 9\nA,A - ab\n"
@@ -2,88 +2,192 @@ import streamlit as st
 import pandas as pd
 import os
 import re
+import codecs
+import hashlib
 from io import StringIO, BytesIO
 
+try:
+    import pyarrow  # noqa: F401
+    # Arrow-backed strings keep text contiguous and run str.* ops in C++
+    _STR_DTYPE = 'string[pyarrow]'
+except ImportError:
+    _STR_DTYPE = str
+
+# Copy-on-Write lets row subsets and assign() share data with the cached
+# upload instead of deep-copying it. pandas 3 always enables it.
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+# Anything other than letters, digits, whitespace and hyphens
+_SPECIAL_RE = re.compile(r'[^a-zA-Z0-9\s-]')
+
+# Lower-cased values treated as empty (N/A, NA, na, blank)
+_NA_SET = frozenset({'n/a', 'na', '', 'blank'})
+
+# Upper bound per cached step so parsed frames and CSV bytes get evicted (LRU)
+_CACHE_ENTRIES = 32
+
+# Rows shown in a review table; the full problem set is never sent to the browser
+_PREVIEW_ROWS = 50
+
+# Bytes sampled from a CSV to pick its encoding before parsing
+_SNIFF_BYTES = 64 * 1024
+
 # -------------------------------------------------
 # File Reading & Helper Functions
 # -------------------------------------------------
 
-def read_file(file):
-    filename = file.name.lower()
+def file_digest(data):
+    """
+    Content hash used to key every cached step for an upload.
+    """
+    return hashlib.sha1(data).hexdigest()
 
-    if filename.endswith('.xlsx'):
-        return pd.read_excel(file, dtype=str, keep_default_na=False, engine='openpyxl')
-    elif filename.endswith('.csv'):
+def read_file(name, digest, data):
+    """
+    Parse an upload into a DataFrame. Parsing is cached on extension +
+    content hash, so reruns and re-uploads of the same file (even under a
+    different name) skip re-parsing.
+    """
+    ext = os.path.splitext(name)[1].lower()
+    if ext not in ('.xlsx', '.csv'):
+        raise ValueError(f"Unsupported file format for {name.lower()}. Please use .csv or .xlsx")
+    return _parse_upload(ext, digest, data)
+
+@st.cache_data(show_spinner=False, max_entries=_CACHE_ENTRIES)
+def _parse_upload(ext, digest, _data):
+    # Convert every column once at ingest, so the cached frame holds compact
+    # string buffers and later str.* / isin calls skip the per-step conversion
+    return _read_upload(ext, _data).astype(_STR_DTYPE)
+
+def _read_upload(ext, data):
+    if ext == '.xlsx':
+        try:
+            return pd.read_excel(BytesIO(data), dtype=str, keep_default_na=False, engine='calamine')
+        except (ImportError, ValueError):
+            # calamine needs pandas >= 2.2 and python-calamine installed
+            return pd.read_excel(BytesIO(data), dtype=str, keep_default_na=False, engine='openpyxl')
+
+    # Files that are visibly not UTF-8 go straight to latin-1 instead of
+    # being parsed once just to fail; a late bad byte still falls back
+    if _looks_utf8(data):
         try:
-            return pd.read_csv(file, dtype=str, keep_default_na=False, encoding='utf-8')
+            return _read_csv(data, 'utf-8')
         except UnicodeDecodeError:
-            file.seek(0)
-            return pd.read_csv(file, dtype=str, keep_default_na=False, encoding='latin-1')
-    else:
-        raise ValueError(f"Unsupported file format for {filename}. Please use .csv or .xlsx")
+            pass
+    return _read_csv(data, 'latin-1')
 
-def contains_special_chars(s):
-    if pd.isna(s):
-        return False
-    
-    s_str = str(s).strip()
-    
-    # Explicitly allow N/A variants
-    if s_str.upper() in ['N/A', 'NA', '']:
+def _looks_utf8(data):
+    """
+    Cheap UTF-8 check on the head of the file.
+    """
+    try:
+        # Incremental decode so a character cut off at the boundary is fine
+        codecs.getincrementaldecoder('utf-8')().decode(data[:_SNIFF_BYTES])
+        return True
+    except UnicodeDecodeError:
         return False
 
-    pattern = re.compile(r'[^a-zA-Z0-9\s-]')
-    return bool(pattern.search(s_str))
+def _read_csv(data, encoding):
+    # The C parser keeps every cell as its literal text and de-duplicates
+    # headers; engine='pyarrow' infers types before the str cast, turning
+    # 00123 into 123, and leaves repeated or empty headers as-is
+    return pd.read_csv(BytesIO(data), dtype=str, keep_default_na=False, encoding=encoding)
 
-def clean_field(value):
+def strip_column(series):
     """
-    Standard cleaner for Tower and Corp fields.
-    Returns empty string if value is N/A, NA, na, or blank.
+    Column as stripped strings, with missing cells as ''.
     """
-    if pd.isna(value):
-        return ''
-    
-    val_str = str(value).strip()
-    if val_str.lower() in ['n/a', 'na', '', 'blank']:
-        return ''
-    
-    return val_str
+    return series.fillna('').astype(_STR_DTYPE).str.strip()
+
+def blank_na(s):
+    """
+    Blank out N/A, NA, na and blank in an already stripped column.
+    """
+    return s.mask(s.str.lower().isin(_NA_SET), '')
+
+def find_special_chars(units):
+    """
+    Special character check over a stripped Unit column.
+    Returns a boolean mask; N/A variants and blanks are explicitly allowed.
+    """
+    # Unit values repeat heavily, so classify each distinct value only once
+    uniq = pd.Series(units.unique())
+    allowed = uniq.str.lower().isin(_NA_SET)
+    # Python's re rather than str.contains: Arrow strings run the pattern
+    # through RE2, whose \s does not match Unicode spaces such as \xa0
+    has_special = uniq.map(lambda u: bool(_SPECIAL_RE.search(u))).astype(bool)
+    bad = uniq[has_special & ~allowed]
+    return units.isin(bad)
+
+def clean_series(series):
+    """
+    Standard cleaner for Tower and Corp columns.
+    Strips values and blanks out N/A, NA, na, blank and missing cells.
+    """
+    return blank_na(strip_column(series))
+
+def clean_tower(df, tower_col):
+    """
+    Cleaned Tower column, or all blanks when the file has no Tower column.
+    """
+    return clean_series(df[tower_col]) if tower_col else pd.Series('', index=df.index, dtype=_STR_DTYPE)
 
 # -------------------------------------------------
 # UI Review Handlers
 # -------------------------------------------------
 
+def show_preview(df):
+    """
+    Show the first _PREVIEW_ROWS rows of df with a row count caption.
+    """
+    st.caption(f"Showing {min(_PREVIEW_ROWS, len(df)):,} of {len(df):,} rows")
+    st.dataframe(df.head(_PREVIEW_ROWS))
+
+@st.fragment
+def decision_controls(kind, file_key, label, actions, button_label):
+    """
+    Radio + confirm button for one review step, stored under
+    decision_{kind}_{file_key}. Runs as a fragment, so toggling the radio
+    only reruns these widgets rather than the whole app.
+    """
+    decision_key = f"decision_{kind}_{file_key}"
+
+    def set_radio():
+        st.session_state[f"choice_{kind}_{file_key}"] = st.session_state[f"radio_{kind}_{file_key}"]
+
+    st.radio(
+        label,
+        tuple(actions),
+        key=f"radio_{kind}_{file_key}",
+        on_change=set_radio
+    )
+
+    current_choice = st.session_state.get(f"choice_{kind}_{file_key}", next(iter(actions)))
+
+    if st.session_state[decision_key] is None:
+        if st.button(button_label, key=f"btn_{kind}_{file_key}"):
+            st.session_state[decision_key] = actions.get(current_choice)
+            # Rerun the whole app so processing continues past this step
+            st.rerun()
+
 def review_special_char_rows(df, file_key):
     decision_key = f"decision_spec_{file_key}"
     
     st.warning("⚠️ Special characters (e.g. dates, symbols) detected!")
     st.write("Review the rows below.")
-    st.dataframe(df.head(50))
+    show_preview(df)
 
     if decision_key not in st.session_state:
         st.session_state[decision_key] = None
 
-    def set_radio_spec():
-        st.session_state[f"choice_spec_{file_key}"] = st.session_state[f"radio_spec_{file_key}"]
-
-    st.radio(
-        "Action for Special Characters:",
-        ("Keep These Rows", "Delete These Rows", "Cancel Processing"),
-        key=f"radio_spec_{file_key}",
-        on_change=set_radio_spec
-    )
-
-    current_choice = st.session_state.get(f"choice_spec_{file_key}", "Keep These Rows")
-
-    def set_decision_spec():
-        st.session_state[decision_key] = {
-            "Keep These Rows": "keep",
-            "Delete These Rows": "delete",
-            "Cancel Processing": "cancel"
-        }.get(current_choice)
+    decision_controls("spec", file_key, "Action for Special Characters:", {
+        "Keep These Rows": "keep",
+        "Delete These Rows": "delete",
+        "Cancel Processing": "cancel"
+    }, "Confirm Special Chars")
 
     if st.session_state[decision_key] is None:
-        st.button("Confirm Special Chars", key=f"btn_spec_{file_key}", on_click=set_decision_spec)
         st.stop()
     
     return st.session_state[decision_key]
@@ -97,32 +201,18 @@ def review_duplicate_rows(df, file_key):
     
     st.warning("⚠️ Duplicate Unit & Tower combinations detected!")
     st.write("The following rows have identical Unit and Tower values:")
-    st.dataframe(df.head(50))
+    show_preview(df)
 
     if decision_key not in st.session_state:
         st.session_state[decision_key] = None
 
-    def set_radio_dup():
-        st.session_state[f"choice_dup_{file_key}"] = st.session_state[f"radio_dup_{file_key}"]
-
-    st.radio(
-        "Action for Duplicates:",
-        ("Keep All (2+ Rows)", "Retain 1 Row", "Cancel Processing"),
-        key=f"radio_dup_{file_key}",
-        on_change=set_radio_dup
-    )
-
-    current_choice = st.session_state.get(f"choice_dup_{file_key}", "Keep All (2+ Rows)")
-
-    def set_decision_dup():
-        st.session_state[decision_key] = {
-            "Keep All (2+ Rows)": "keep",
-            "Retain 1 Row": "retain_one",
-            "Cancel Processing": "cancel"
-        }.get(current_choice)
+    decision_controls("dup", file_key, "Action for Duplicates:", {
+        "Keep All (2+ Rows)": "keep",
+        "Retain 1 Row": "retain_one",
+        "Cancel Processing": "cancel"
+    }, "Confirm Duplicates")
 
     if st.session_state[decision_key] is None:
-        st.button("Confirm Duplicates", key=f"btn_dup_{file_key}", on_click=set_decision_dup)
         st.stop()
     
     return st.session_state[decision_key]
@@ -131,121 +221,207 @@ def review_duplicate_rows(df, file_key):
 # Main Cleaning Logic
 # -------------------------------------------------
 
+def find_columns(df):
+    """
+    Locate the Tower, Unit and Corporate columns by substring match.
+    Returns (tower_col, unit_col, corp_col); missing columns are None.
+    """
+    # Lower-case each header once rather than once per lookup
+    lowered = {c: str(c).lower() for c in df.columns}
+
+    def find(sub):
+        return next((c for c, l in lowered.items() if sub in l), None)
+
+    return find('tower'), find('unit'), find('corporate')
+
+def duplicate_keys(units, tower):
+    """
+    Unit + Tower keys used to strictly check duplicates ignoring whitespace.
+    units is the stripped Unit column (see strip_column) and tower the
+    cleaned Tower column (see clean_tower). Tower is low-cardinality, so it
+    is kept categorical and hashed as codes.
+    """
+    return pd.DataFrame({
+        '__temp_unit': units,
+        '__temp_tower': tower.astype('category'),
+    }, index=units.index)
+
+@st.cache_data(show_spinner=False, max_entries=_CACHE_ENTRIES)
+def get_special_char_mask(name, digest, _data, unit_col):
+    """
+    Special character mask for the upload identified by digest. The frame is
+    always parsed from _data itself, so a cached mask can only describe the
+    content its key names.
+    """
+    df = read_file(name, digest, _data)
+    return find_special_chars(strip_column(df[unit_col])).to_numpy()
+
+@st.cache_data(show_spinner=False, max_entries=_CACHE_ENTRIES)
+def get_duplicate_mask(name, digest, _data, decision_spec, unit_col, tower_col):
+    """
+    Duplicate mask for the upload identified by digest, after decision_spec
+    has been applied to it.
+    """
+    df = read_file(name, digest, _data)
+    if decision_spec == "delete":
+        df = df.loc[~get_special_char_mask(name, digest, _data, unit_col)]
+    keys = duplicate_keys(strip_column(df[unit_col]), clean_tower(df, tower_col))
+    return keys.duplicated(keep=False).to_numpy()
+
+@st.cache_data(show_spinner=False, max_entries=_CACHE_ENTRIES)
+def build_output(name, digest, _data, decision_spec, duplicate_decision):
+    """
+    Apply the review decisions and build the cleaned CSV.
+    Cached on content hash + decisions, so the encoded bytes live in the
+    Streamlit cache rather than in session_state.
+    Returns (result_message, csv_bytes).
+    """
+    df = read_file(name, digest, _data)
+    tower_col, unit_col, corp_col = find_columns(df)
+    deleted_rows_count = 0
+
+    # Strip Unit once; it is sliced alongside df and reused by every step below
+    units = strip_column(df[unit_col])
+
+    if decision_spec == "delete":
+        special_char_mask = get_special_char_mask(name, digest, _data, unit_col)
+        df, units = df.loc[~special_char_mask], units.loc[~special_char_mask]
+        deleted_rows_count = int(special_char_mask.sum())
+
+    # Clean Tower once; it feeds both the dedup keys and the Unit strings
+    tower = clean_tower(df, tower_col)
+
+    if duplicate_decision == "retain_one":
+        # Keep first, drop rest
+        keep = ~duplicate_keys(units, tower).duplicated(keep='first')
+        df, units, tower = df.loc[keep], units.loc[keep], tower.loc[keep]
+
+    # -----------------------------------------
+    # 3. Build Unit Strings (Always Concatenate)
+    # -----------------------------------------
+    # Clean values (removes N/A, Blank, NA, na)
+    unit = blank_na(units)
+
+    # Tower first if it exists, then Unit, joined with hyphens. The separator
+    # is only present where both parts are, so no row builds a throwaway string.
+    sep = (tower.ne('') & unit.ne('')).map({True: ' - ', False: ''}).astype(_STR_DTYPE)
+    df = df.assign(Unit=tower + sep + unit)
+
+    # -----------------------------------------
+    # 4. Final Cleanup & Output
+    # -----------------------------------------
+    
+    if duplicate_decision == "retain_one":
+        df_unique = df.drop_duplicates(subset=['Unit'], ignore_index=True)
+    else:
+        df_unique = df.reset_index(drop=True)
+
+    # Blank out N/A placeholders, only rewriting columns that contain one
+    for c in df_unique.columns:
+        na_mask = df_unique[c].isin(['N/A', 'n/a', 'na'])
+        if na_mask.any():
+            df_unique[c] = df_unique[c].mask(na_mask, '')
+
+    # Encode straight into a byte buffer rather than building the whole CSV as a str first
+    buffer = BytesIO()
+    df_unique.to_csv(buffer, index=False, encoding='utf-8')
+
+    result_message = f"✅ Processed: {name}\n"
+    if deleted_rows_count > 0:
+        result_message += f"🗑️ Deleted {deleted_rows_count} rows with special characters.\n"
+    result_message += f"🔢 Total Rows: {len(df_unique)}"
+
+    return result_message, buffer.getvalue()
+
+def finish_file(file_key, message):
+    """
+    Record the final result for a file and release its parsed DataFrame,
+    which is never read again once a result exists.
+    """
+    st.session_state[f"result_{file_key}"] = message
+    st.session_state.pop(f"data_{file_key}", None)
+    return message
+
+def clear_file_state(file_key):
+    """
+    Drop every per-file session state key of one upload slot.
+    """
+    for prefix in FILE_STATE_PREFIXES:
+        st.session_state.pop(f"{prefix}{file_key}", None)
+
 def clean_units_streamlit(file, file_key):
     result_key = f"result_{file_key}"
+
+    # Slot state belongs to the upload that created it; a different file in
+    # this slot (e.g. after the key list was regenerated) starts over
+    upload_key = f"upload_{file_key}"
+    if st.session_state.get(upload_key) != file.file_id:
+        clear_file_state(file_key)
+        st.session_state[upload_key] = file.file_id
     
     if result_key in st.session_state:
         return st.session_state[result_key]
 
+    # Register the file so handle_upload can drop its state without a scan
+    st.session_state.setdefault('_per_file_keys', set()).add(file_key)
+
     try:
+        data = file.getvalue()
+        digest = file_digest(data)
+
         data_key = f"data_{file_key}"
         if data_key not in st.session_state:
-            st.session_state[data_key] = read_file(file)
+            st.session_state[data_key] = read_file(file.name, digest, data)
 
-        df = st.session_state[data_key].copy()
+        # Never mutate the parsed upload; each step below returns a new frame
+        df = st.session_state[data_key]
 
-        # Identify Columns
-        tower_col = next((c for c in df.columns if 'tower' in c.lower()), None)
-        unit_col = next((c for c in df.columns if 'unit' in c.lower()), None)
-        corp_col = next((c for c in df.columns if 'corporate' in c.lower()), None)
+        # Identify Columns once per file; reruns reuse the stored lookup
+        cols_key = f"cols_{file_key}"
+        if cols_key not in st.session_state:
+            st.session_state[cols_key] = find_columns(df)
+        tower_col, unit_col, corp_col = st.session_state[cols_key]
 
         if not unit_col:
-            st.session_state[result_key] = f"⚠️ No 'Unit' column found in {file.name}."
-            return st.session_state[result_key]
+            return finish_file(file_key, f"⚠️ No 'Unit' column found in {file.name}.")
 
         # -----------------------------------------
         # 1. Check Special Characters
         # -----------------------------------------
-        special_char_mask = df[unit_col].apply(contains_special_chars)
-        problem_rows = df[special_char_mask]
-        deleted_rows_count = 0
+        special_char_mask = get_special_char_mask(file.name, digest, data, unit_col)
+        decision_spec = None
 
-        if not problem_rows.empty:
+        # Clean files (the common case) skip slicing out problem rows entirely
+        if special_char_mask.any():
             st.subheader(f"Step 1: Special Characters ({file.name})")
-            decision_spec = review_special_char_rows(problem_rows, file_key) 
+            decision_spec = review_special_char_rows(df[special_char_mask], file_key) 
 
             if decision_spec == "delete":
-                df.drop(problem_rows.index, inplace=True)
-                deleted_rows_count = len(problem_rows)
+                df = df.loc[~special_char_mask]
             elif decision_spec == "cancel":
-                st.session_state[result_key] = f"🟡 Canceled processing for {file.name}."
-                return st.session_state[result_key]
+                return finish_file(file_key, f"🟡 Canceled processing for {file.name}.")
 
         # -----------------------------------------
         # 2. Check Duplicates (Unit + Tower)
         # -----------------------------------------
-        # Create temp columns to strictly check duplicates ignoring whitespace
-        df['__temp_unit'] = df[unit_col].apply(lambda x: str(x).strip())
-        df['__temp_tower'] = df[tower_col].apply(clean_field) if tower_col else ''
-        
-        # Check for duplicates on these two columns
-        dup_mask = df.duplicated(subset=['__temp_unit', '__temp_tower'], keep=False)
-        dup_rows = df[dup_mask]
+        # Check for duplicates on the stripped Unit + cleaned Tower keys
+        dup_mask = get_duplicate_mask(file.name, digest, data, decision_spec, unit_col, tower_col)
         
         duplicate_decision = "retain_one" # Default behavior if no duplicates found
 
-        if not dup_rows.empty:
+        # Only materialize the duplicate rows when there is something to review
+        if dup_mask.any():
             st.divider()
             st.subheader(f"Step 2: Duplicates ({file.name})")
-            duplicate_decision = review_duplicate_rows(dup_rows, file_key)
+            duplicate_decision = review_duplicate_rows(df[dup_mask], file_key)
 
-            if duplicate_decision == "retain_one":
-                # Keep first, drop rest
-                df.drop_duplicates(subset=['__temp_unit', '__temp_tower'], keep='first', inplace=True)
-            elif duplicate_decision == "cancel":
-                st.session_state[result_key] = f"🟡 Canceled processing for {file.name} (Duplicates)."
-                return st.session_state[result_key]
+            if duplicate_decision == "cancel":
+                return finish_file(file_key, f"🟡 Canceled processing for {file.name} (Duplicates).")
 
         # -----------------------------------------
-        # 3. Build Unit Strings (Always Concatenate)
+        # 3. Build Output & Download
         # -----------------------------------------
-        # Refresh temp columns after potential drops
-        df['__temp_unit'] = df[unit_col].apply(lambda x: str(x).strip())
-        df['_CleanUnit'] = df['__temp_unit']
-        
-        def build_unit_unconditional(row):
-            # 1. Gather raw values
-            raw_unit = row['_CleanUnit']
-            raw_tower = row[tower_col] if tower_col else ''
-            raw_corp = row[corp_col] if corp_col else ''
-
-            # 2. Clean values (removes N/A, Blank, NA, na)
-            unit = clean_field(raw_unit) # Though unit usually shouldn't be NA if we got this far
-            tower = clean_field(raw_tower)
-            corp = clean_field(raw_corp)
-
-            # 3. Concatenate non-empty parts
-            parts = []
-            
-            # Add Tower first if exists
-            if tower:
-                parts.append(tower)
-            
-            # Add Unit (Essential)
-            if unit:
-                parts.append(unit)
-
-            # Join with hyphens
-            return " - ".join(parts)
-
-        df['Unit'] = df.apply(build_unit_unconditional, axis=1)
-
-        # -----------------------------------------
-        # 4. Final Cleanup & Output
-        # -----------------------------------------
-        
-        if duplicate_decision == "retain_one":
-            df_unique = df.drop_duplicates(subset=['Unit']).reset_index(drop=True)
-        else:
-            df_unique = df.reset_index(drop=True)
-
-        cols_to_drop = ['_CleanUnit', '__temp_unit', '__temp_tower']
-        df_unique.drop(columns=[c for c in cols_to_drop if c in df_unique.columns], inplace=True)
-        
-        df_unique.replace({'N/A': '', 'n/a': '', 'na': '', '': ''}, inplace=True)
-
-        output = df_unique.to_csv(index=False).encode('utf-8')
-        st.session_state[f"output_{file_key}"] = output
+        result_message, output = build_output(file.name, digest, data, decision_spec, duplicate_decision)
 
         st.download_button(
             label=f"⬇️ Download Cleaned File ({file.name})",
@@ -255,17 +431,10 @@ def clean_units_streamlit(file, file_key):
             key=f"download_{file_key}"
         )
 
-        result_message = f"✅ Processed: {file.name}\n"
-        if deleted_rows_count > 0:
-            result_message += f"🗑️ Deleted {deleted_rows_count} rows with special characters.\n"
-        result_message += f"🔢 Total Rows: {len(df_unique)}"
-
-        st.session_state[result_key] = result_message
-        return st.session_state[result_key]
+        return finish_file(file_key, result_message)
 
     except Exception as e:
-        st.session_state[result_key] = f"❌ Error processing {file.name}: {e}"
-        return st.session_state[result_key]
+        return finish_file(file_key, f"❌ Error processing {file.name}: {e}")
 
 
 # -------------------------------------------------
@@ -277,16 +446,23 @@ if 'uploaded_files_keys' not in st.session_state:
 
 st.title("🏢 Unit Configuration Cleaner Tool")
 
+# Per-file session state keys are "<prefix><file_key>"
+FILE_STATE_PREFIXES = ('upload_', 'result_', 'data_', 'cols_', 'decision_spec_', 'choice_spec_', 'radio_spec_',
+                       'decision_dup_', 'choice_dup_', 'radio_dup_')
+
 def handle_upload():
-    keys_to_delete = []
-    # Clean up all possible session state keys for files
-    for key in st.session_state['uploaded_files_keys']:
-        suffixes = ['result', 'data', 'decision_spec', 'choice_spec', 'radio_spec', 
-                    'decision_dup', 'choice_dup', 'radio_dup', 'output']
-        for suf in suffixes:
-            full_key = f"{suf}_{key}"
-            if full_key in st.session_state:
-                del st.session_state[full_key]
+    # The uploader can fire without the selection actually changing; keep
+    # the parsed data and results in that case. file_id identifies each
+    # upload, so a re-upload under the same name and size still resets.
+    upload_sig = [f.file_id for f in st.session_state.uploaded_files_widget or []]
+    if upload_sig == st.session_state.get('_upload_sig'):
+        return
+    st.session_state['_upload_sig'] = upload_sig
+
+    # Clean up the per-file session state of every file that created any,
+    # including files from a batch whose key list was regenerated
+    for file_key in st.session_state.pop('_per_file_keys', ()):
+        clear_file_state(file_key)
     
     if st.session_state.uploaded_files_widget:
         st.session_state['uploaded_files_keys'] = [f"file_{i}" for i in range(len(st.session_state.uploaded_files_widget))]